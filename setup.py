@@ -18,6 +18,13 @@ setup(
         "scipy~=1.11"
     ],
     python_requires=">=3.10",
+    entry_points={
+        "console_scripts": [
+            "spectrograph=spectrograph.app:main",
+            "spectrograph-decode=spectrograph.cli_decoder:main",
+            "spectrograph-convert=spectrograph.recording:main",
+        ],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -0,0 +1,17 @@
+import argparse
+
+from .datamodel import DEFAULT_PRECISION, PRECISIONS
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tool to measure vibrations")
+    parser.add_argument("--precision", choices=PRECISIONS.keys(), default=DEFAULT_PRECISION,
+        help="floating point precision of the analysis")
+    args, qt_args = parser.parse_known_args()
+
+    # Qt and pyqtgraph are loaded only once the arguments are parsed, so
+    # --help and argument errors do not pay for them
+    from .gui import run
+    run(args.precision, qt_args)
+
+if __name__ == "__main__":
+    main()
@@ -37,5 +37,11 @@ def run(port: str) -> None:
                 print(f"{transform_to_g(x, range_value)}, {transform_to_g(y, range_value)}, {transform_to_g(z, range_value)}")
 
 
-if __name__ == "__main__":
+def main() -> None:
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <port>")
+        sys.exit(1)
     run(sys.argv[1])
+
+if __name__ == "__main__":
+    main()
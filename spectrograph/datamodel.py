@@ -3,16 +3,26 @@ import itertools
 from queue import Queue
 from threading import Thread, Lock
 import time
-from typing import Tuple
-from cobs import cobs
+from typing import TYPE_CHECKING, Tuple
 from collections import deque
 import numpy as np
-import scipy
-import serial
+
+# scipy, serial and cobs are imported lazily where they are needed, so that
+# tools working only with recorded data start quickly
+if TYPE_CHECKING:
+    import serial
 
 SAMPLING_RATE = 4000
 MAX_HISTORY = 5 * 60 * 4000
 
+# The sensor delivers 16-bit samples, float32 is more than enough for the
+# analysis and halves the memory traffic compared to float64
+PRECISIONS = {
+    "float32": np.float32,
+    "float64": np.float64,
+}
+DEFAULT_PRECISION = "float32"
+
 def project_xyz(arr):
     return x + y + z
 
@@ -25,40 +35,113 @@ def project_y(x, y, z):
 def project_z(x, y, z):
     return z
 
+_analysis_modules = None
+
+def get_analysis_modules():
+    """
+    Return (scipy.fft, scipy.signal), importing them on the first call
+    """
+    global _analysis_modules
+    if _analysis_modules is None:
+        import scipy.fft
+        import scipy.signal
+        _analysis_modules = (scipy.fft, scipy.signal)
+    return _analysis_modules
+
 class AccelerometerData:
-    def __init__(self) -> None:
+    def __init__(self, precision: str = DEFAULT_PRECISION) -> None:
+       self.dtype = np.dtype(PRECISIONS[precision])
+       self.windows = {}
        self.data = deque([], MAX_HISTORY)
-       self.prepared_data = np.array(self.data)
+       self.prepared_data = np.array(self.data, dtype=self.dtype)
        self.tmp_data = []
+       self.recording = None
+       self.first_sample = 0
+       self.range_changes = []
 
     def set_data(self, data) -> None:
-        self.data = deque(data, MAX_HISTORY)
-        self.prepared_data = np.array(self.data)
+        self.data = deque(np.asarray(data, dtype=self.dtype), MAX_HISTORY)
+        self.prepared_data = np.array(self.data, dtype=self.dtype)
         self.tmp_data = []
+        self.recording = None
+        self.first_sample = 0
+        self.range_changes = []
+
+    def set_recording(self, recording) -> None:
+        """
+        Use a chunked recording as the data source. Sample windows are read
+        from the recording on demand instead of keeping it all in memory.
+        """
+        if recording.sampling_rate != SAMPLING_RATE:
+            raise ValueError(f"Unsupported sampling rate {recording.sampling_rate} Hz, "
+                             f"expected {SAMPLING_RATE} Hz")
+        self.set_data([])
+        recording.set_dtype(self.dtype)
+        self.recording = recording
+        self.range_changes = recording.range_changes
 
     def as_np(self) -> None:
-        return np.array(self.data)
+        if self.recording is not None:
+            return self.recording.read_all()
+        return np.array(self.data, dtype=self.dtype)
 
     def push_sample(self, sample: Tuple[float, float, float]) -> None:
-        self.tmp_data.append(np.array(sample))
+        self.tmp_data.append(np.array(sample, dtype=self.dtype))
+
+    def has_new_samples(self) -> bool:
+        return len(self.tmp_data) != 0
+
+    def mark_range(self, range_value: int) -> None:
+        sample = self.first_sample + self.get_sample_count() + len(self.tmp_data)
+        self.range_changes.append((sample, range_value))
+
+    def get_range_changes(self):
+        """
+        Return range changes as (sample index, range) relative to the
+        oldest sample kept in the history
+        """
+        changes = []
+        for sample, range_value in self.range_changes:
+            if sample <= self.first_sample:
+                # Only the last change before the history start is in effect
+                changes = [(0, range_value)]
+            else:
+                changes.append((sample - self.first_sample, range_value))
+        return changes
 
     def clear(self):
         self.data = deque([], MAX_HISTORY)
 
+    def get_sample_count(self) -> int:
+        if self.recording is not None:
+            return self.recording.sample_count
+        return len(self.data)
+
     def get_length(self) -> float:
         """
         Return length in seconds
         """
-        return len(self.data) / SAMPLING_RATE
+        return self.get_sample_count() / SAMPLING_RATE
 
     def pull_samples(self):
          # Not entirely safe, but...
         x = self.tmp_data
         self.tmp_data = []
+
+        if len(x) != 0 and self.recording is not None:
+            # New samples arrived on top of a loaded recording, we have to
+            # switch back to the in-memory history
+            self.data = deque(self.recording.read_all(), MAX_HISTORY)
+            self.first_sample += max(self.recording.sample_count - MAX_HISTORY, 0)
+            self.recording = None
+
+        overflow = len(self.data) + len(x) - MAX_HISTORY
+        if overflow > 0:
+            self.first_sample += overflow
         self.data.extend(x)
 
         if len(x) != 0:
-            self.prepared_data = np.array(self.data)
+            self.prepared_data = np.array(self.data, dtype=self.dtype)
 
     def get_sample_count_for_window(self, duration):
         return round(duration * SAMPLING_RATE)
@@ -67,39 +150,54 @@ class AccelerometerData:
 
         expected_samples = self.get_sample_count_for_window(to_t - from_t)
 
+        sample_count = self.get_sample_count()
         start_idx = int(from_t * SAMPLING_RATE)
         if start_idx < 0:
             start_idx = 0
-        if start_idx > len(self.data):
-            start_idx = len(self.data)
+        if start_idx > sample_count:
+            start_idx = sample_count
 
         end_idx = start_idx + expected_samples
 
-        if end_idx > len(self.data):
-            end_idx = len(self.data)
+        if end_idx > sample_count:
+            end_idx = sample_count
 
         if end_idx - start_idx != expected_samples:
-            return np.full((expected_samples,), 0)
+            return np.full((expected_samples,), 0, dtype=self.dtype)
+
+        if self.recording is not None:
+            samples = self.recording.read(start_idx, end_idx)
+        else:
+            samples = self.prepared_data[start_idx:end_idx]
 
         if sample_projection == "project_xyz":
-            x = np.sum(self.prepared_data[start_idx:end_idx], axis=1)
+            x = np.sum(samples, axis=1)
         elif sample_projection == "project_x":
-            x = self.prepared_data[start_idx:end_idx, 0]
+            x = samples[:, 0]
         elif sample_projection == "project_y":
-            x = self.prepared_data[start_idx:end_idx, 1]
+            x = samples[:, 1]
         elif sample_projection == "project_z":
-            x = self.prepared_data[start_idx:end_idx, 2]
+            x = samples[:, 2]
         return x
 
 
+    def get_window(self, length: int) -> np.ndarray:
+        if length not in self.windows:
+            self.windows[length] = np.hanning(length).astype(self.dtype)
+        return self.windows[length]
+
     def get_fft(self, from_t, to_t, from_freq, to_freq, sample_projection) -> Tuple[np.array, np.array]:
         source = self.get_sample_window(from_t, to_t, sample_projection)
         assert len(source) != 0
 
-        source = scipy.signal.detrend(source)
+        scipy_fft, scipy_signal = get_analysis_modules()
+
+        # detrend and rfft preserve float32 input, keep the window in the
+        # same precision so the product is not upcast
+        source = scipy_signal.detrend(source)
 
-        fft = (4 / len(source)) * np.absolute(scipy.fft.rfft(np.hanning(len(source)) * source))
-        bins = scipy.fft.rfftfreq(len(source), 1 / SAMPLING_RATE)
+        fft = (4 / len(source)) * np.absolute(scipy_fft.rfft(self.get_window(len(source)) * source))
+        bins = scipy_fft.rfftfreq(len(source), 1 / SAMPLING_RATE)
 
         time_low_limit = np.searchsorted(bins, from_freq)
         time_high_limit = np.searchsorted(bins, to_freq)
@@ -122,6 +220,9 @@ class ThreadPortReadout(Thread):
         self.command_queue = Queue()
 
     def run(self):
+        from cobs import cobs
+        import serial
+
         try:
             with serial.Serial(port=self.port, baudrate=921600) as connection:
                 while self.should_be_running:
@@ -159,7 +260,7 @@ class ThreadPortReadout(Thread):
         self.should_be_running = False
         self.join()
 
-    def read_cobs_packet(self, connection: serial.Serial) -> bytearray:
+    def read_cobs_packet(self, connection: "serial.Serial") -> bytearray:
         data = bytearray()
         while True:
             byte = connection.read(1)
@@ -186,5 +287,7 @@ class ThreadPortReadout(Thread):
         self.command_queue.put_nowait(range)
 
     def _send_set_range(self, port, range) -> None:
+        from cobs import cobs
+
         message = cobs.encode(bytes([3, range.value])) + bytes([0])
         port.write(message)
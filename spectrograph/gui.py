@@ -4,12 +4,16 @@ import sys
 import time
 import numpy as np
 import pyqtgraph as pg
-import serial.tools.list_ports
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QComboBox, QFrame, QSplitter, QSlider, QLineEdit, QCheckBox, QLabel, QSpacerItem, QSizePolicy, QMessageBox, QFileDialog
 from PyQt5.QtGui import QDoubleValidator, QTransform
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
 
-from .datamodel import SAMPLING_RATE, AccelerometerData, SensorRange, ThreadPortReadout, project_x, project_xyz, project_y, project_z
+from .datamodel import DEFAULT_PRECISION, SAMPLING_RATE, AccelerometerData, SensorRange, ThreadPortReadout, project_x, project_xyz, project_y, project_z
+from .peaks import PeakTracker
+from .recording import open_recording, save_recording
+
+RECORDING_FILTER = "Záznam spektra (*.sgrec)"
+LEGACY_FILTER = "Záznam spektra - starý formát (*.npy)"
 
 def plasma_colormap(amplitude):
     return pg.ColorMap(
@@ -34,6 +38,66 @@ def plasma_colormap(amplitude):
             [240, 249, 33],
         ]))
 
+class FrameScheduler(QObject):
+    """
+    Drive all periodic GUI work from a single timer. A frame is rendered only
+    when something changed since the last one (new samples, parameters or
+    time slider). The interval adapts so that rendering takes at most
+    1 / LOAD_FACTOR of the wall time.
+    """
+    MIN_INTERVAL = 33
+    MAX_INTERVAL = 500
+    LOAD_FACTOR = 4
+    FRAME_BUDGET = 0.05
+    PORT_SCAN_INTERVAL = 2
+
+    def __init__(self, parent, render, has_new_data, periodic=None):
+        super().__init__(parent)
+
+        self.render = render
+        self.has_new_data = has_new_data
+        self.periodic = periodic
+        self.dirty = True
+        self.interval = self.MIN_INTERVAL
+        self.last_port_scan = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._tick)
+
+    def start(self):
+        self.timer.start(0)
+
+    def mark_dirty(self, *args):
+        if not self.dirty and self.timer.remainingTime() > self.MIN_INTERVAL:
+            # The scheduler may be idling on a long interval, react to user
+            # input promptly
+            self.timer.start(self.MIN_INTERVAL)
+        self.dirty = True
+
+    def _tick(self):
+        if self.periodic is not None and time.perf_counter() - self.last_port_scan > self.PORT_SCAN_INTERVAL:
+            self.last_port_scan = time.perf_counter()
+            self.periodic()
+
+        # Measure the frame after the periodic work so it does not eat the
+        # frame budget
+        now = time.perf_counter()
+        if self.dirty or self.has_new_data():
+            # Changes made during the render are already reflected in it, so
+            # the frame is clean afterwards unless the budget ran out
+            unfinished = self.render(now + self.FRAME_BUDGET)
+            self.dirty = unfinished
+            elapsed = 1000 * (time.perf_counter() - now)
+            if unfinished:
+                # Catch up with the pending spectrogram lines as fast as the
+                # frame budget allows
+                self.interval = self.MIN_INTERVAL
+            else:
+                self.interval = int(min(max(self.LOAD_FACTOR * elapsed, self.MIN_INTERVAL), self.MAX_INTERVAL))
+
+        self.timer.start(self.interval)
+
 class DivisionLineWidget(QFrame):
     def __init__(self):
         super().__init__()
@@ -109,9 +173,15 @@ class SliderInputWidget(QWidget):
         return float(self.value_input.text())
 
 class DataVisualizationWidget(QWidget):
+    SPECTROGRAM_LINES = 300
+    # Peaks below this fraction of the displayed range are not tracked
+    PEAK_THRESHOLD = 0.05
+
     def __init__(self):
         super().__init__()
 
+        self.peak_tracker = PeakTracker(self.SPECTROGRAM_LINES)
+        self.peak_tracking = False
         self.spectrogram = None
         self.spectrogram_args = None
         self.spectrogram_time_offset = 0
@@ -139,6 +209,9 @@ class DataVisualizationWidget(QWidget):
         self.spectrogram_v_line = pg.InfiniteLine(angle=90, movable=False)
         self.spectrogram_v_line.setPen((255, 255, 255), width=2)
         self.spectrogram_widget.addItem(self.spectrogram_v_line)
+        self.peak_overlay = pg.ScatterPlotItem(size=4, pen=None, brush=pg.mkBrush(255, 255, 255, 160))
+        self.peak_overlay.setVisible(False)
+        self.spectrogram_widget.addItem(self.peak_overlay)
 
         # Align their X-axis
         self.spectrogram_widget.setXLink(self.graph_widget)
@@ -159,17 +232,30 @@ class DataVisualizationWidget(QWidget):
         pos = evt[0]
         if self.graph_widget.sceneBoundingRect().contains(pos):
             mouse_point = self.graph_widget.plotItem.vb.mapSceneToView(pos)
+            freq, amplitude = mouse_point.x(), mouse_point.y()
+
+            if self.peak_tracking:
+                peak = self.peak_tracker.nearest_peak(self.time_slider.get_value(), freq)
+                if peak is not None:
+                    freq, amplitude, _ = peak
 
-            omega = mouse_point.x() * 2 * np.pi
-            acc = 9.81 * mouse_point.y()
+            omega = freq * 2 * np.pi
+            acc = 9.81 * amplitude
             position = acc / omega / omega
 
             position_um = position * 1000 * 1000
 
-            self.graph_widget.setTitle("<span style='font-size: 12pt'>Frekvence=%0.0f Hz, <span style='color: red'>Amplituda=%0.3f g, %0.6f µm</span>" % (mouse_point.x(), mouse_point.y(), position_um))
-            self.v_line.setPos(mouse_point.x())
-            self.h_line.setPos(mouse_point.y())
-            self.spectrogram_v_line.setPos(mouse_point.x())
+            self.graph_widget.setTitle("<span style='font-size: 12pt'>Frekvence=%0.0f Hz, <span style='color: red'>Amplituda=%0.3f g, %0.6f µm</span>" % (freq, amplitude, position_um))
+            self.v_line.setPos(freq)
+            self.h_line.setPos(amplitude)
+            self.spectrogram_v_line.setPos(freq)
+
+    def set_peak_tracking(self, value):
+        self.peak_tracking = value
+        self.peak_overlay.setVisible(value)
+        # Peaks are only tracked while enabled, rebuild the spectrogram to
+        # fill in the history
+        self.spectrogram_args = None
 
     def update_spectrum(self, sample_window, min_freq, max_freq, y_range,
                spectrogram_length, sample_projection, datasource):
@@ -195,8 +281,13 @@ class DataVisualizationWidget(QWidget):
         self.spectrogram_time_offset = -1
 
     def update_spectrogram(self, sample_window, min_freq, max_freq, y_range,
-            spectrogram_length, sample_projection, datasource):
-        SPECTROGRAM_LINES = 300
+            spectrogram_length, sample_projection, datasource, deadline=None):
+        """
+        Compute missing spectrogram lines and redraw it. When deadline
+        (perf_counter time) is given, stop computing once it passes and return
+        True to signal that more lines are pending.
+        """
+        SPECTROGRAM_LINES = self.SPECTROGRAM_LINES
         time_offset = self.time_slider.get_value() - datasource.get_length()
 
         args = (sample_window, min_freq, max_freq, spectrogram_length, sample_projection)
@@ -206,12 +297,16 @@ class DataVisualizationWidget(QWidget):
 
             _, y = datasource.get_fft(0, sample_window, min_freq, max_freq, sample_projection)
             self.expected_samples = len(y)
-            self.spectrogram = deque([np.full((self.expected_samples,), 0)
+            self.spectrogram = deque([np.full((self.expected_samples,), 0, dtype=datasource.dtype)
                 for _ in range(SPECTROGRAM_LINES)
             ], maxlen = SPECTROGRAM_LINES)
             self.spectrogram_last_time = datasource.get_length() + self.spectrogram_time_offset - spectrogram_length
+            self.peak_tracker.reset()
+
+        # Range is not part of the spectrogram args, keep the threshold current
+        self.peak_tracker.threshold = self.PEAK_THRESHOLD * y_range
 
-        steps_made = 0
+        unfinished = False
         while True:
             start = self.spectrogram_last_time + spectrogram_length / SPECTROGRAM_LINES
             end = start + sample_window
@@ -219,17 +314,18 @@ class DataVisualizationWidget(QWidget):
                 break
 
             if start < 0 and end < 0:
-                self.spectrogram.append(np.full((self.expected_samples,), 0))
+                self.spectrogram.append(np.full((self.expected_samples,), 0, dtype=datasource.dtype))
             else:
-                _, y = datasource.get_fft(start, end, min_freq, max_freq, sample_projection)
+                bins, y = datasource.get_fft(start, end, min_freq, max_freq, sample_projection)
                 self.spectrogram.append(y)
-                steps_made += 1
+                if self.peak_tracking:
+                    self.peak_tracker.add_column(end, bins, y)
 
             self.spectrogram_last_time = start
 
-            # Do not make the GUI responsive
-            # if steps_made > 50:
-            #     break
+            if deadline is not None and time.perf_counter() > deadline:
+                unfinished = True
+                break
 
         line_count = len(self.spectrogram)
 
@@ -237,7 +333,7 @@ class DataVisualizationWidget(QWidget):
         img.setLevels([0, y_range], update=False)
         img.setColorMap(plasma_colormap(y_range))
         img.setImage(
-            np.transpose(self.spectrogram),
+            np.array(self.spectrogram, dtype=datasource.dtype).T,
             autoLevels=False)
 
         img.setTransform(QTransform()
@@ -249,6 +345,16 @@ class DataVisualizationWidget(QWidget):
 
         self.spectrogram_widget.setYRange(-spectrogram_length, 0)
 
+        if self.peak_tracking:
+            # Columns are tracked by the end of their window, place the
+            # points at the center of the corresponding spectrogram line
+            last_end = self.spectrogram_last_time + sample_window
+            times, freqs, _, _ = self.peak_tracker.get_points(last_end - spectrogram_length, last_end)
+            line_height = spectrogram_length / line_count
+            self.peak_overlay.setData(freqs, times - last_end - line_height / 2)
+
+        return unfinished
+
     def on_readout_start(self):
         self.time_slider.move_to_max()
 
@@ -322,8 +428,13 @@ class ControlPanelWidget(QWidget):
         self.sample_projection_combo.addItem("Analýza X")
         self.sample_projection_combo.addItem("Analýza Y")
         self.sample_projection_combo.addItem("Analýza Z")
+        self.sample_projection_combo.currentIndexChanged.connect(self.params_updated.emit)
         parameter_input_group.addWidget(self.sample_projection_combo)
 
+        self.peak_tracking_checkbox = QCheckBox("Sledovat vrcholy")
+        self.peak_tracking_checkbox.toggled.connect(self.params_updated.emit)
+        parameter_input_group.addWidget(self.peak_tracking_checkbox)
+
         # Add widgets to the layout
         self.layout.addLayout(connection_widget_group)
         self.layout.addWidget(DivisionLineWidget())
@@ -335,12 +446,8 @@ class ControlPanelWidget(QWidget):
         self.layout.setSpacing(20)
         self.setLayout(self.layout)
 
-        # Create a timer to periodically refresh the COM port list every 2 seconds
-        self.refresh_timer = QTimer(self)
-        self.refresh_timer.timeout.connect(self.populate_com_ports)
-        self.refresh_timer.start(2000)  # Refresh every 2 seconds
-
-        # Initial population of COM port dropdown
+        # Initial population of COM port dropdown, it is refreshed
+        # periodically by the main window
         self.populate_com_ports()
 
         # Connect button click handlers
@@ -348,9 +455,17 @@ class ControlPanelWidget(QWidget):
         self.stop_button.clicked.connect(self.stop_recording)
 
     def populate_com_ports(self):
+        import serial.tools.list_ports
+
         com_ports = [port.device for port in serial.tools.list_ports.comports()]
+        current = [self.com_ports_combo.itemText(i) for i in range(self.com_ports_combo.count())]
+        if com_ports == current:
+            return
+        selected = self.com_ports_combo.currentText()
         self.com_ports_combo.clear()
         self.com_ports_combo.addItems(com_ports)
+        if selected in com_ports:
+            self.com_ports_combo.setCurrentIndex(com_ports.index(selected))
 
     def start_recording(self):
         idx = self.com_ports_combo.currentIndex()
@@ -397,11 +512,12 @@ class ControlPanelWidget(QWidget):
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, precision=DEFAULT_PRECISION):
         super().__init__()
 
-        self.data = AccelerometerData()
+        self.data = AccelerometerData(precision)
         self.readout = None
+        self.device = None
 
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -419,31 +535,13 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, 800, 600)
         self.setWindowTitle("Spectrogram")
 
-        self.refresh_widget_timer = QTimer(self)
-        self.refresh_widget_timer.timeout.connect(lambda:
-            self.data_visualization_widget.update_spectrum(
-                self.control_panel_widget.window_size_input.get_value(),
-                self.control_panel_widget.min_freq_input.get_value(),
-                self.control_panel_widget.max_freq_input.get_value(),
-                self.control_panel_widget.range_input.get_value(),
-                self.control_panel_widget.length_input.get_value(),
-                self.control_panel_widget.get_selected_projection(),
-                self.data
-            ))
-        self.refresh_widget_timer.start(100)
-
-        self.refresh_spectrograph_timer = QTimer(self)
-        self.refresh_spectrograph_timer.timeout.connect(lambda:
-            self.data_visualization_widget.update_spectrogram(
-                self.control_panel_widget.window_size_input.get_value(),
-                self.control_panel_widget.min_freq_input.get_value(),
-                self.control_panel_widget.max_freq_input.get_value(),
-                self.control_panel_widget.range_input.get_value(),
-                self.control_panel_widget.length_input.get_value(),
-                self.control_panel_widget.get_selected_projection(),
-                self.data
-            ))
-        self.refresh_spectrograph_timer.start(100)
+        self.scheduler = FrameScheduler(self, self.render_frame,
+            self.data.has_new_samples, self.control_panel_widget.populate_com_ports)
+        self.control_panel_widget.params_updated.connect(self.scheduler.mark_dirty)
+        self.control_panel_widget.peak_tracking_checkbox.toggled.connect(
+            self.data_visualization_widget.set_peak_tracking)
+        self.data_visualization_widget.time_slider.valueChanged.connect(self.scheduler.mark_dirty)
+        self.scheduler.start()
 
         self.control_panel_widget.recording_start.connect(self.on_readout_start)
         self.control_panel_widget.recording_stop.connect(self.on_readout_stop)
@@ -452,17 +550,35 @@ class MainWindow(QMainWindow):
         self.control_panel_widget.save_button.clicked.connect(self.save_trace)
         self.control_panel_widget.clear_button.clicked.connect(self.clear_trace)
 
+    def render_frame(self, deadline):
+        params = (
+            self.control_panel_widget.window_size_input.get_value(),
+            self.control_panel_widget.min_freq_input.get_value(),
+            self.control_panel_widget.max_freq_input.get_value(),
+            self.control_panel_widget.range_input.get_value(),
+            self.control_panel_widget.length_input.get_value(),
+            self.control_panel_widget.get_selected_projection(),
+            self.data
+        )
+        self.data_visualization_widget.update_spectrum(*params)
+        return self.data_visualization_widget.update_spectrogram(*params, deadline=deadline)
+
     def on_readout_start(self, port):
+        self.device = port
         self.readout = ThreadPortReadout(port, self.data.push_sample)
         self.readout.start()
         self.data_visualization_widget.on_readout_start()
 
     def on_range_change(self, range):
-        self.readout.set_range(range)
+        # Range changes are only meaningful for live data
+        if self.readout is not None:
+            self.data.mark_range(range.value)
+            self.readout.set_range(range)
 
     def on_readout_stop(self):
         if self.readout is not None:
             self.readout.stop()
+            self.readout = None
 
     def closeEvent(self, event):
         if self.readout is not None:
@@ -473,12 +589,18 @@ class MainWindow(QMainWindow):
         options |= QFileDialog.ReadOnly
 
         file_path, _ = QFileDialog.getOpenFileName(self,
-            "Náčíst záznam", "", "Záznam spektra (*.npy);;All Files(*)", options = options)
+            "Náčíst záznam", "", f"{RECORDING_FILTER};;{LEGACY_FILTER};;All Files(*)", options = options)
 
         if file_path:
             try:
-                data = np.load(file_path)
-                self.data.set_data(data)
+                if file_path.endswith(".npy"):
+                    self.data.set_data(np.load(file_path))
+                    self.device = None
+                else:
+                    recording = open_recording(file_path, self.data.dtype)
+                    self.data.set_recording(recording)
+                    self.device = recording.device
+                self.scheduler.mark_dirty()
             except Exception as e:
                 message_box = QMessageBox()
                 message_box.setIcon(QMessageBox.Critical)
@@ -490,13 +612,21 @@ class MainWindow(QMainWindow):
     def save_trace(self):
         options = QFileDialog.Options()
 
-        file_path, _ = QFileDialog.getSaveFileName(self,
-            "Uložit záznam", "", "Záznam spektra (*.npy);;All Files(*)", options = options)
+        file_path, selected_filter = QFileDialog.getSaveFileName(self,
+            "Uložit záznam", "", f"{RECORDING_FILTER};;{LEGACY_FILTER};;All Files(*)", options = options)
         if file_path:
-            if not file_path.endswith(".npy"):
-                file_path = file_path + ".npy"
+            legacy = selected_filter == LEGACY_FILTER or file_path.endswith(".npy")
+            extension = ".npy" if legacy else ".sgrec"
+            if not file_path.endswith(extension):
+                file_path = file_path + extension
             try:
-                np.save(file_path, self.data.as_np())
+                if legacy:
+                    np.save(file_path, self.data.as_np())
+                else:
+                    save_recording(file_path, self.data.as_np(),
+                        sampling_rate=SAMPLING_RATE,
+                        device=self.device,
+                        range_changes=self.data.get_range_changes())
             except Exception as e:
                 message_box = QMessageBox()
                 message_box.setIcon(QMessageBox.Critical)
@@ -508,9 +638,14 @@ class MainWindow(QMainWindow):
     def clear_trace(self):
         self.data.set_data([])
         self.data_visualization_widget.clear_spectrogram()
+        self.scheduler.mark_dirty()
 
-if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+def run(precision=DEFAULT_PRECISION, qt_args=()):
+    app = QApplication(sys.argv[:1] + list(qt_args))
+    window = MainWindow(precision)
     window.show()
     sys.exit(app.exec_())
+
+if __name__ == '__main__':
+    from .app import main
+    main()
@@ -0,0 +1,132 @@
+from bisect import bisect_left, bisect_right
+from typing import Optional, Tuple
+import numpy as np
+
+def find_peaks(bins: np.ndarray, spectrum: np.ndarray, threshold: float,
+               max_peaks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find local maxima of the spectrum above threshold. Peak position and
+    amplitude are refined by fitting a parabola through the peak bin and its
+    neighbours. Return at most max_peaks strongest peaks sorted by frequency.
+    """
+    if len(spectrum) < 3:
+        return np.empty(0), np.empty(0)
+
+    left, center, right = spectrum[:-2], spectrum[1:-1], spectrum[2:]
+    idx = np.flatnonzero((center > left) & (center >= right) & (center > threshold))
+    if len(idx) > max_peaks:
+        idx = np.sort(idx[np.argpartition(center[idx], -max_peaks)[-max_peaks:]])
+
+    # The peak bin is strictly above its left neighbour, so the parabola
+    # is never degenerate
+    a, b, c = left[idx], center[idx], right[idx]
+    offset = 0.5 * (a - c) / (a - 2 * b + c)
+
+    step = bins[1] - bins[0]
+    freqs = bins[idx + 1] + offset * step
+    amplitudes = b - 0.25 * (a - c) * offset
+    return freqs, amplitudes
+
+class PeakTracker:
+    """
+    Detect peaks in spectrogram columns as they are produced and link them
+    into tracks. Columns are stored in time order and peaks within a column
+    in frequency order, so the nearest peak to a (time, frequency) point is
+    found by two binary searches.
+    """
+    MAX_PEAKS = 8
+    # Maximal frequency change between two consecutive columns of a track, in bins
+    MAX_JUMP = 3
+    # Number of columns a track may miss before it is terminated
+    MAX_GAP = 2
+
+    def __init__(self, max_columns: int) -> None:
+        self.max_columns = max_columns
+        self.reset()
+
+    def reset(self, threshold: float = 0) -> None:
+        self.threshold = threshold
+        self.times = []
+        self.columns = []
+        self.active = {}
+        self.next_track = 0
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add_column(self, t: float, bins: np.ndarray, spectrum: np.ndarray) -> None:
+        freqs, amplitudes = find_peaks(bins, spectrum, self.threshold, self.MAX_PEAKS)
+        tracks = self._link(freqs, amplitudes, bins[1] - bins[0] if len(bins) > 1 else 0)
+
+        self.times.append(t)
+        self.columns.append((freqs, amplitudes, tracks))
+        if len(self.times) > 2 * self.max_columns:
+            # Trim in batches to keep appends amortized O(1)
+            del self.times[:-self.max_columns]
+            del self.columns[:-self.max_columns]
+
+    def _link(self, freqs: np.ndarray, amplitudes: np.ndarray, step: float) -> np.ndarray:
+        tracks = np.full(len(freqs), -1, dtype=np.int64)
+
+        # Strongest peaks pick their continuation first
+        for i in np.argsort(-amplitudes):
+            best, best_distance = None, self.MAX_JUMP * step
+            for track, (freq, _) in self.active.items():
+                distance = abs(freq - freqs[i])
+                if distance <= best_distance and track not in tracks:
+                    best, best_distance = track, distance
+            if best is None:
+                best = self.next_track
+                self.next_track += 1
+            tracks[i] = best
+
+        continued = set(tracks.tolist())
+        self.active = {
+            track: (freq, 0 if track in continued else missed + 1)
+            for track, (freq, missed) in self.active.items()
+            if track in continued or missed < self.MAX_GAP
+        }
+        for track, freq in zip(tracks.tolist(), freqs.tolist()):
+            self.active[track] = (freq, 0)
+        return tracks
+
+    def nearest_column(self, t: float) -> Optional[int]:
+        if not self.times:
+            return None
+        idx = bisect_left(self.times, t)
+        if idx == len(self.times):
+            return idx - 1
+        if idx > 0 and t - self.times[idx - 1] < self.times[idx] - t:
+            return idx - 1
+        return idx
+
+    def nearest_peak(self, t: float, freq: float) -> Optional[Tuple[float, float, int]]:
+        """
+        Return (frequency, amplitude, track) of the peak closest to freq in
+        the column closest to time t
+        """
+        column = self.nearest_column(t)
+        if column is None:
+            return None
+        freqs, amplitudes, tracks = self.columns[column]
+        if len(freqs) == 0:
+            return None
+        idx = int(np.searchsorted(freqs, freq))
+        if idx == len(freqs) or (idx > 0 and freq - freqs[idx - 1] < freqs[idx] - freq):
+            idx -= 1
+        return float(freqs[idx]), float(amplitudes[idx]), int(tracks[idx])
+
+    def get_points(self, from_t: float, to_t: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return times, frequencies, amplitudes and track IDs of all peaks in
+        the columns within [from_t, to_t]
+        """
+        first = bisect_left(self.times, from_t)
+        last = bisect_right(self.times, to_t)
+        columns = self.columns[first:last]
+        if not columns:
+            return np.empty(0), np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+        times = np.concatenate([np.full(len(freqs), t)
+            for t, (freqs, _, _) in zip(self.times[first:last], columns)])
+        freqs, amplitudes, tracks = (np.concatenate(x) for x in zip(*columns))
+        return times, freqs, amplitudes, tracks
@@ -0,0 +1,286 @@
+from collections import OrderedDict
+import json
+import lzma
+import struct
+import sys
+import time
+import zlib
+from typing import List, Optional, Tuple
+import numpy as np
+
+from .datamodel import SAMPLING_RATE
+
+# File layout:
+#   MAGIC, u32 header length, UTF-8 JSON header
+#   compressed chunks, one after another
+#   index: CHUNK_ENTRY per chunk
+#   trailer: u64 index offset, u32 chunk count, FOOTER_MAGIC
+MAGIC = b"SGREC\x00\x01\x00"
+FOOTER_MAGIC = b"SGRIDX\x00\x00"
+CHUNK_ENTRY = struct.Struct("<QIQIBB")
+TRAILER = struct.Struct("<QI8s")
+
+CHUNK_SIZE = 4 * SAMPLING_RATE
+
+ENCODING_INT16 = 1
+ENCODING_FLOAT64 = 2
+ENCODING_FLOAT32 = 3
+
+CODECS = {
+    "zlib": (lambda b: zlib.compress(b, 6), zlib.decompress),
+    "lzma": (lambda b: lzma.compress(b, preset=6), lzma.decompress),
+}
+
+SENSOR_RANGES = (2, 4, 8, 16)
+
+class RecordingError(Exception):
+    pass
+
+def _shuffle(raw: np.ndarray) -> bytes:
+    # Group bytes of equal significance together, compresses considerably
+    # better than the interleaved little-endian representation
+    return np.ascontiguousarray(raw.view(np.uint8).reshape(-1, raw.itemsize).T).tobytes()
+
+def _unshuffle(buffer: bytes, dtype) -> np.ndarray:
+    itemsize = np.dtype(dtype).itemsize
+    raw = np.frombuffer(buffer, dtype=np.uint8).reshape(itemsize, -1).T
+    return np.ascontiguousarray(raw).view(dtype).reshape(-1)
+
+def _encode_chunk(samples: np.ndarray) -> Tuple[int, int, bytes]:
+    """
+    Encode chunk losslessly. Samples that came from the sensor are exact
+    multiples of range / 32767 (possibly rounded to float32), so we store
+    the raw 16-bit counts when possible and fall back to the sample
+    precision otherwise.
+    """
+    for range_value in SENSOR_RANGES:
+        scale = range_value / 32767
+        counts = np.rint(samples.astype(np.float64) / scale)
+        # -32768 is a valid reading of a clipping sensor
+        if np.any((counts < -32768) | (counts > 32767)):
+            continue
+        if np.array_equal((scale * counts).astype(samples.dtype), samples):
+            return ENCODING_INT16, range_value, _shuffle(counts.astype("<i2"))
+    if samples.dtype == np.float32:
+        return ENCODING_FLOAT32, 0, _shuffle(samples.astype("<f4"))
+    return ENCODING_FLOAT64, 0, _shuffle(samples.astype("<f8"))
+
+def _decode_chunk(encoding: int, range_value: int, buffer: bytes, dtype) -> np.ndarray:
+    if encoding == ENCODING_INT16:
+        # Scale in float64 first, it reproduces the values of the readout
+        # exactly before rounding to the target precision
+        counts = _unshuffle(buffer, "<i2")
+        return (range_value / 32767 * counts.astype(np.float64)).astype(dtype).reshape(-1, 3)
+    if encoding == ENCODING_FLOAT64:
+        return _unshuffle(buffer, "<f8").astype(dtype, copy=False).reshape(-1, 3)
+    if encoding == ENCODING_FLOAT32:
+        return _unshuffle(buffer, "<f4").astype(dtype, copy=False).reshape(-1, 3)
+    raise RecordingError(f"Unknown chunk encoding {encoding}")
+
+class RecordingWriter:
+    """
+    Write samples to a chunked recording. Samples can be appended
+    incrementally, the index is written on close.
+    """
+    def __init__(self, path: str, sampling_rate: int = SAMPLING_RATE,
+                 device: Optional[str] = None,
+                 range_changes: Optional[List[Tuple[int, int]]] = None,
+                 codec: str = "zlib", chunk_size: int = CHUNK_SIZE) -> None:
+        if codec not in CODECS:
+            raise RecordingError(f"Unknown codec {codec}")
+        self.compress = CODECS[codec][0]
+        self.chunk_size = chunk_size
+        self.pending = None
+        self.index = []
+        self.sample_count = 0
+        # Chunks are split at range changes so that every chunk has a single
+        # scale and can be stored as 16-bit counts
+        self.boundaries = sorted({int(s) for s, _ in (range_changes or []) if s > 0})
+
+        header = json.dumps({
+            "sampling_rate": sampling_rate,
+            "device": device,
+            "range_changes": [[int(s), int(r)] for s, r in (range_changes or [])],
+            "codec": codec,
+            "chunk_size": chunk_size,
+            "created": time.time(),
+        }).encode("utf-8")
+
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.file.write(struct.pack("<I", len(header)))
+        self.file.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def append(self, samples) -> None:
+        samples = np.asarray(samples).reshape(-1, 3)
+        if samples.dtype not in (np.float32, np.float64):
+            samples = samples.astype(np.float64)
+        # Keep the precision of the incoming samples, upcasting float32 to
+        # float64 would defeat the 16-bit encoding
+        if self.pending is None:
+            self.pending = samples
+        else:
+            self.pending = np.concatenate((self.pending, samples))
+        while True:
+            limit = self._next_chunk_size()
+            if len(self.pending) < limit:
+                break
+            self._flush_chunk(self.pending[:limit])
+            self.pending = self.pending[limit:]
+
+    def _next_chunk_size(self) -> int:
+        while self.boundaries and self.boundaries[0] <= self.sample_count:
+            self.boundaries.pop(0)
+        if self.boundaries:
+            return min(self.chunk_size, self.boundaries[0] - self.sample_count)
+        return self.chunk_size
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        if self.pending is not None and len(self.pending) != 0:
+            self._flush_chunk(self.pending)
+        self.pending = None
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(CHUNK_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(index_offset, len(self.index), FOOTER_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def _flush_chunk(self, samples: np.ndarray) -> None:
+        encoding, range_value, raw = _encode_chunk(samples.reshape(-1))
+        payload = self.compress(raw)
+        self.index.append((self.sample_count, len(samples), self.file.tell(),
+                           len(payload), encoding, range_value))
+        self.file.write(payload)
+        self.sample_count += len(samples)
+
+class Recording:
+    """
+    Read-only view of a chunked recording. Only chunks overlapping the
+    requested sample range are read and decompressed; recently used chunks
+    are kept in a small cache so that scrubbing over the same region is cheap.
+    Chunks are decoded directly into dtype.
+    """
+    CACHE_SIZE = 16
+
+    def __init__(self, path: str, dtype=np.float64) -> None:
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.cache = OrderedDict()
+
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise RecordingError("Not a spectrograph recording")
+            header_length, = struct.unpack("<I", f.read(4))
+            self.metadata = json.loads(f.read(header_length).decode("utf-8"))
+
+            f.seek(-TRAILER.size, 2)
+            index_offset, chunk_count, footer = TRAILER.unpack(f.read(TRAILER.size))
+            if footer != FOOTER_MAGIC:
+                raise RecordingError("Recording is truncated")
+            f.seek(index_offset)
+            index = f.read(chunk_count * CHUNK_ENTRY.size)
+
+        if self.metadata["codec"] not in CODECS:
+            raise RecordingError(f"Unknown codec {self.metadata['codec']}")
+        self.decompress = CODECS[self.metadata["codec"]][1]
+        self.index = [CHUNK_ENTRY.unpack_from(index, i * CHUNK_ENTRY.size)
+            for i in range(chunk_count)]
+        self.chunk_starts = np.array([entry[0] for entry in self.index], dtype=np.int64)
+        self.sample_count = sum(entry[1] for entry in self.index)
+
+    @property
+    def sampling_rate(self) -> int:
+        return self.metadata["sampling_rate"]
+
+    @property
+    def device(self) -> Optional[str]:
+        return self.metadata["device"]
+
+    @property
+    def range_changes(self) -> List[Tuple[int, int]]:
+        return [tuple(change) for change in self.metadata["range_changes"]]
+
+    def get_length(self) -> float:
+        """
+        Return length in seconds
+        """
+        return self.sample_count / self.sampling_rate
+
+    def set_dtype(self, dtype) -> None:
+        dtype = np.dtype(dtype)
+        if dtype != self.dtype:
+            self.dtype = dtype
+            self.cache.clear()
+
+    def chunk_for_time(self, t: float) -> int:
+        return self.chunk_for_sample(int(t * self.sampling_rate))
+
+    def chunk_for_sample(self, sample: int) -> int:
+        idx = int(np.searchsorted(self.chunk_starts, sample, side="right")) - 1
+        return min(max(idx, 0), len(self.index) - 1)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        start = max(start, 0)
+        end = min(end, self.sample_count)
+        if end <= start:
+            return np.empty((0, 3), dtype=self.dtype)
+
+        first = self.chunk_for_sample(start)
+        last = self.chunk_for_sample(end - 1)
+        parts = [self._get_chunk(i) for i in range(first, last + 1)]
+        samples = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        offset = self.index[first][0]
+        return samples[start - offset:end - offset]
+
+    def read_all(self) -> np.ndarray:
+        return self.read(0, self.sample_count)
+
+    def _get_chunk(self, idx: int) -> np.ndarray:
+        if idx in self.cache:
+            self.cache.move_to_end(idx)
+            return self.cache[idx]
+
+        _, _, offset, length, encoding, range_value = self.index[idx]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            payload = f.read(length)
+        samples = _decode_chunk(encoding, range_value, self.decompress(payload), self.dtype)
+
+        self.cache[idx] = samples
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return samples
+
+def save_recording(path: str, samples, **metadata) -> None:
+    with RecordingWriter(path, **metadata) as writer:
+        writer.append(samples)
+
+def open_recording(path: str, dtype=np.float64) -> Recording:
+    return Recording(path, dtype)
+
+def convert_npy(source: str, target: str, **metadata) -> None:
+    """
+    Convert a legacy .npy trace (N x 3 array of samples in g) to a recording
+    """
+    samples = np.load(source)
+    if samples.ndim != 2 or samples.shape[1] != 3:
+        raise RecordingError(f"Expected N x 3 array, got {samples.shape}")
+    save_recording(target, samples, **metadata)
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} <trace.npy> <recording.sgrec>")
+        sys.exit(1)
+    convert_npy(sys.argv[1], sys.argv[2])
+
+if __name__ == "__main__":
+    main()
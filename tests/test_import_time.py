@@ -0,0 +1,60 @@
+import importlib.util
+import json
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["PyQt5", "pyqtgraph", "scipy", "serial", "cobs"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": sorted(sys.modules)}}))
+"""
+
+# Run the GUI entry point as `spectrograph --help`, argparse exits before
+# anything but the argument parser is needed
+HELP = """
+sys.argv = ["spectrograph", "--help"]
+from spectrograph.app import main
+try:
+    main()
+except SystemExit:
+    pass
+"""
+
+def probe(code):
+    result = subprocess.run([sys.executable, "-c", PROBE.format(code=code)],
+        capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def check_startup(code, budget, allowed=()):
+    # Take the best of a few runs, the first one may pay for a cold disk cache
+    runs = [probe(code) for _ in range(3)]
+
+    loaded = {name.split(".")[0] for name in runs[0]["loaded"]}
+    for heavy in HEAVY_MODULES:
+        if heavy not in allowed:
+            assert heavy not in loaded, f"imports {heavy}"
+    assert min(run["elapsed"] for run in runs) < budget
+
+# Budgets are in seconds, numpy alone takes roughly 0.1 s
+@pytest.mark.parametrize("module, budget, allowed", [
+    ("spectrograph.recording", 0.4, []),
+    ("spectrograph.datamodel", 0.4, []),
+    ("spectrograph.cli_decoder", 0.2, ["serial", "cobs"]),
+    ("spectrograph.app", 0.4, []),
+])
+def test_entry_point_imports(module, budget, allowed):
+    check_startup(f"import {module}", budget, allowed)
+
+def test_gui_help_does_not_load_qt():
+    check_startup(HELP, 0.4)
+
+@pytest.mark.skipif(importlib.util.find_spec("PyQt5") is None
+    or importlib.util.find_spec("pyqtgraph") is None, reason="PyQt5 and pyqtgraph required")
+def test_gui_import():
+    check_startup("import spectrograph.gui", 2.0, ["PyQt5", "pyqtgraph"])
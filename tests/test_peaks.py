@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from spectrograph.peaks import PeakTracker, find_peaks
+
+BINS = np.arange(0, 1000, 1.0)
+
+def tone_spectrum(*tones):
+    """
+    Spectrum with Gaussian shaped lines a few bins wide
+    """
+    spectrum = np.zeros(len(BINS))
+    for freq, amplitude in tones:
+        spectrum += amplitude * np.exp(-0.5 * ((BINS - freq) / 1.5) ** 2)
+    return spectrum
+
+def test_off_bin_tone_is_interpolated():
+    freqs, amplitudes = find_peaks(BINS, tone_spectrum((100.3, 1), (407.8, 0.5)), 0.1, 8)
+    np.testing.assert_allclose(freqs, [100.3, 407.8], atol=0.05)
+    np.testing.assert_allclose(amplitudes, [1, 0.5], rtol=0.01)
+
+def test_strongest_peaks_are_kept():
+    tones = [(50 + 100 * i, 0.1 * (i + 1)) for i in range(9)]
+    freqs, _ = find_peaks(BINS, tone_spectrum(*tones), 0.05, 3)
+    np.testing.assert_allclose(freqs, [650, 750, 850], atol=0.05)
+
+def test_threshold():
+    freqs, _ = find_peaks(BINS, tone_spectrum((100, 1), (300, 0.2)), 0.5, 8)
+    np.testing.assert_allclose(freqs, [100], atol=0.05)
+
+def test_drifting_tone_keeps_track():
+    tracker = PeakTracker(100)
+    tracker.reset(0.1)
+    for i in range(50):
+        tracker.add_column(i * 0.1, BINS, tone_spectrum((200 + 1.5 * i, 1), (700, 0.5)))
+
+    _, freqs, _, tracks = tracker.get_points(0, 10)
+    assert len(set(tracks[freqs < 500].tolist())) == 1
+    assert len(set(tracks[freqs > 500].tolist())) == 1
+    assert len(set(tracks.tolist())) == 2
+
+def test_track_ends_after_gap():
+    tracker = PeakTracker(100)
+    tracker.reset(0.1)
+    tone = tone_spectrum((300, 1))
+    empty = np.zeros(len(BINS))
+
+    tracker.add_column(0, BINS, tone)
+    for i in range(PeakTracker.MAX_GAP):
+        tracker.add_column(1 + i, BINS, empty)
+    tracker.add_column(10, BINS, tone)
+    assert tracker.nearest_peak(10, 300)[2] == tracker.nearest_peak(0, 300)[2]
+
+    for i in range(PeakTracker.MAX_GAP + 1):
+        tracker.add_column(11 + i, BINS, empty)
+    tracker.add_column(20, BINS, tone)
+    assert tracker.nearest_peak(20, 300)[2] != tracker.nearest_peak(10, 300)[2]
+
+def test_nearest_peak():
+    tracker = PeakTracker(100)
+    assert tracker.nearest_peak(0, 100) is None
+
+    tracker.reset(0.1)
+    tracker.add_column(1.0, BINS, tone_spectrum((100, 1), (500, 1)))
+    tracker.add_column(2.0, BINS, tone_spectrum((150, 1), (550, 1)))
+    tracker.add_column(3.0, BINS, np.zeros(len(BINS)))
+
+    assert tracker.nearest_peak(-5, 120)[0] == pytest.approx(100, abs=0.05)
+    assert tracker.nearest_peak(1.6, 120)[0] == pytest.approx(150, abs=0.05)
+    assert tracker.nearest_peak(1.6, 340)[0] == pytest.approx(150, abs=0.05)
+    assert tracker.nearest_peak(1.6, 360)[0] == pytest.approx(550, abs=0.05)
+    assert tracker.nearest_peak(1.0, -100)[0] == pytest.approx(100, abs=0.05)
+    assert tracker.nearest_peak(1.0, 5000)[0] == pytest.approx(500, abs=0.05)
+    # The last column has no peaks
+    assert tracker.nearest_peak(100, 100) is None
+
+def test_get_points_after_trimming():
+    tracker = PeakTracker(10)
+    tracker.reset(0.1)
+    for i in range(25):
+        tracker.add_column(float(i), BINS, tone_spectrum((100 + i, 1)))
+
+    assert len(tracker) <= 20
+    assert tracker.times[-1] == 24
+    times, freqs, _, _ = tracker.get_points(0, 100)
+    assert times[0] == tracker.times[0] >= 5
+    np.testing.assert_allclose(freqs, 100 + times, atol=0.05)
+
+    times, _, _, _ = tracker.get_points(20, 22.5)
+    np.testing.assert_array_equal(times, [20, 21, 22])
+    assert len(tracker.get_points(30, 40)[0]) == 0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from spectrograph.datamodel import SAMPLING_RATE, AccelerometerData
+from spectrograph.recording import ENCODING_FLOAT32, ENCODING_INT16, Recording, save_recording
+
+PROJECTIONS = ["project_xyz", "project_x", "project_y", "project_z"]
+
+def quantized_signal(seconds=3, range_value=2):
+    rng = np.random.default_rng(42)
+    t = np.arange(seconds * SAMPLING_RATE) / SAMPLING_RATE
+    signal = np.stack([
+        0.5 * np.sin(2 * np.pi * 50 * t) + 0.1 * np.sin(2 * np.pi * 733 * t),
+        0.3 * np.sin(2 * np.pi * 120 * t + 1),
+        0.2 * np.sin(2 * np.pi * 1500 * t) + 1,
+    ], axis=1) + 0.05 * rng.standard_normal((len(t), 3))
+    counts = np.clip(np.rint(signal * 32767 / range_value), -32767, 32767)
+    return range_value / 32767 * counts
+
+@pytest.mark.parametrize("projection", PROJECTIONS)
+def test_float32_fft_matches_float64(projection):
+    samples = quantized_signal()
+    single = AccelerometerData("float32")
+    double = AccelerometerData("float64")
+    single.set_data(samples)
+    double.set_data(samples)
+
+    for from_t in (0, 0.5, 1.7):
+        bins32, fft32 = single.get_fft(from_t, from_t + 1, 0, 2000, projection)
+        bins64, fft64 = double.get_fft(from_t, from_t + 1, 0, 2000, projection)
+
+        assert fft32.dtype == np.float32
+        assert fft64.dtype == np.float64
+        np.testing.assert_array_equal(bins32, bins64)
+        assert np.max(np.abs(fft32 - fft64)) < 1e-5
+
+def test_float32_storage():
+    data = AccelerometerData("float32")
+    data.push_sample((0.1, 0.2, 0.3))
+    data.pull_samples()
+    assert data.prepared_data.dtype == np.float32
+    assert data.as_np().dtype == np.float32
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_float32_recording_uses_int16(tmp_path, dtype):
+    samples = quantized_signal(seconds=5).astype(dtype)
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples)
+
+    loaded = Recording(str(path), dtype)
+    assert all(entry[4] == ENCODING_INT16 for entry in loaded.index)
+    read = loaded.read(100, 9000)
+    assert read.dtype == dtype
+    np.testing.assert_array_equal(read, samples[100:9000])
+
+def test_float32_fallback_encoding(tmp_path):
+    samples = np.random.default_rng(1).standard_normal((5000, 3)).astype(np.float32)
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples)
+
+    loaded = Recording(str(path), np.float32)
+    assert all(entry[4] == ENCODING_FLOAT32 for entry in loaded.index)
+    np.testing.assert_array_equal(loaded.read_all(), samples)
+
+def test_recording_decoded_in_analysis_precision(tmp_path):
+    samples = quantized_signal()
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples)
+
+    data = AccelerometerData("float32")
+    data.set_recording(Recording(str(path)))
+    window = data.get_sample_window(0.5, 1.5, "project_x")
+    assert window.dtype == np.float32
+    assert all(chunk.dtype == np.float32 for chunk in data.recording.cache.values())
+    np.testing.assert_array_equal(window, samples[2000:6000, 0].astype(np.float32))
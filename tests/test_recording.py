@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from spectrograph import recording
+from spectrograph.datamodel import AccelerometerData
+from spectrograph.recording import ENCODING_FLOAT64, ENCODING_INT16, Recording, save_recording
+
+def sensor_samples(count, range_value, low=-32768):
+    rng = np.random.default_rng(0)
+    counts = rng.integers(low, 32768, size=(count, 3))
+    return range_value / 32767 * counts
+
+def encodings(loaded):
+    return [(entry[4], entry[5]) for entry in loaded.index]
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_round_trip(tmp_path, codec):
+    samples = sensor_samples(10000, 4)
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples, codec=codec, chunk_size=3000, device="COM3")
+
+    loaded = Recording(str(path))
+    assert loaded.sample_count == len(samples)
+    assert loaded.device == "COM3"
+    assert encodings(loaded) == [(ENCODING_INT16, 4)] * 4
+    np.testing.assert_array_equal(loaded.read_all(), samples)
+    assert path.stat().st_size < samples.size * 2.5
+
+def test_clipped_samples_use_int16(tmp_path):
+    samples = sensor_samples(1000, 2)
+    samples[10, 1] = 2 / 32767 * -32768
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples)
+
+    loaded = Recording(str(path))
+    assert encodings(loaded) == [(ENCODING_INT16, 2)]
+    np.testing.assert_array_equal(loaded.read_all(), samples)
+
+def test_chunks_split_at_range_changes(tmp_path):
+    samples = np.concatenate((sensor_samples(2500, 2), sensor_samples(4000, 4, low=0)))
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples, chunk_size=2000, range_changes=[(0, 2), (2500, 4)])
+
+    loaded = Recording(str(path))
+    assert loaded.range_changes == [(0, 2), (2500, 4)]
+    assert [entry[1] for entry in loaded.index] == [2000, 500, 2000, 2000]
+    assert all(encoding == ENCODING_INT16 for encoding, _ in encodings(loaded))
+    np.testing.assert_array_equal(loaded.read_all(), samples)
+
+def test_arbitrary_samples_stay_lossless(tmp_path):
+    samples = np.random.default_rng(1).standard_normal((5000, 3))
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples)
+
+    loaded = Recording(str(path))
+    assert encodings(loaded) == [(ENCODING_FLOAT64, 0)]
+    np.testing.assert_array_equal(loaded.read_all(), samples)
+
+def test_random_access(tmp_path):
+    samples = sensor_samples(20000, 2)
+    path = tmp_path / "trace.sgrec"
+    save_recording(str(path), samples, chunk_size=4000)
+
+    loaded = Recording(str(path))
+    np.testing.assert_array_equal(loaded.read(3900, 8100), samples[3900:8100])
+    assert set(loaded.cache) == {0, 1, 2}
+    assert loaded.chunk_for_time(12000 / loaded.sampling_rate) == 3
+
+def test_convert_npy(tmp_path):
+    samples = sensor_samples(5000, 8)
+    source = tmp_path / "trace.npy"
+    target = tmp_path / "trace.sgrec"
+    np.save(source, samples)
+    recording.convert_npy(str(source), str(target))
+    np.testing.assert_array_equal(Recording(str(target)).read_all(), samples)
+
+def test_range_changes_before_history_start():
+    data = AccelerometerData()
+    data.range_changes = [(0, 2), (50, 4), (100, 8), (150, 16)]
+    data.first_sample = 100
+    assert data.get_range_changes() == [(0, 8), (50, 16)]